@@ -51,6 +51,7 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        transaction_per_migration=True,
     )
 
     with context.begin_transaction():
@@ -71,8 +72,13 @@ def run_migrations_online() -> None:
     )
 
     with connectable.connect() as connection:
+        # run each revision in its own transaction, so online migrations (see
+        # src/database/migrations.py) that step outside the transaction only
+        # commit the work of their own revision
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection,
+            target_metadata=target_metadata,
+            transaction_per_migration=True,
         )
 
         with context.begin_transaction():
@@ -0,0 +1,34 @@
+"""creating users id byte order index
+
+Revision ID: 4d8e6b1f9c23
+Revises: e5a91c3d7b40
+Create Date: 2026-10-19 15:12:40.281907
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from src.database.migrations import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4d8e6b1f9c23'
+down_revision: Union[str, Sequence[str], None] = 'e5a91c3d7b40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # users are listed in byte order of their id (see src/database/sharding.py), which the primary key index only
+    # serves when the database's collation is "C" - other databases already compare strings by their bytes
+    if op.get_bind().dialect.name == 'postgresql':
+        create_index_concurrently('ix_users_id_byte_order', 'users', [sa.text('id COLLATE "C"')])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        drop_index_concurrently('ix_users_id_byte_order', 'users')
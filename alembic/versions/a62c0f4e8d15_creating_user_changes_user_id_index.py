@@ -0,0 +1,31 @@
+"""creating user changes user id index
+
+Revision ID: a62c0f4e8d15
+Revises: 4d8e6b1f9c23
+Create Date: 2026-10-19 17:41:08.512306
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from src.database.migrations import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a62c0f4e8d15'
+down_revision: Union[str, Sequence[str], None] = '4d8e6b1f9c23'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # removing or moving a user erases the snapshots in their earlier change feed entries
+    create_index_concurrently('ix_user_changes_user_id', 'user_changes', ['user_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    drop_index_concurrently('ix_user_changes_user_id', 'user_changes')
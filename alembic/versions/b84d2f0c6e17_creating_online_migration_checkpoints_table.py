@@ -0,0 +1,35 @@
+"""creating online migration checkpoints table
+
+Revision ID: b84d2f0c6e17
+Revises: 3f1c7e52a8d4
+Create Date: 2026-10-19 10:04:55.618230
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b84d2f0c6e17'
+down_revision: Union[str, Sequence[str], None] = '3f1c7e52a8d4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('online_migration_checkpoints',
+    sa.Column('name', sa.String(length=255), nullable=False),
+    sa.Column('last_key', sa.String(length=255), nullable=True),
+    sa.Column('rows_processed', sa.BigInteger(), nullable=False),
+    sa.Column('completed_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('online_migration_checkpoints')
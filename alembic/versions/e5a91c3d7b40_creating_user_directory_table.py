@@ -0,0 +1,35 @@
+"""creating user directory table
+
+Revision ID: e5a91c3d7b40
+Revises: b84d2f0c6e17
+Create Date: 2026-10-19 11:37:20.884152
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a91c3d7b40'
+down_revision: Union[str, Sequence[str], None] = 'b84d2f0c6e17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('user_directory',
+    sa.Column('email', sa.String(length=255), nullable=False),
+    sa.Column('user_id', sa.String(length=22), nullable=False),
+    sa.Column('reserved_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('email')
+    )
+    # register the existing users - entries that belong on another shard are moved by src/database/rebalance.py
+    op.execute("INSERT INTO user_directory (email, user_id, reserved_at) SELECT email, id, CURRENT_TIMESTAMP FROM users")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('user_directory')
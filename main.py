@@ -1,8 +1,9 @@
 from fastapi import FastAPI
 from loguru import logger
 
-from src.routes import user_router, secure_endpoint_router
+from src.routes import user_router, secure_endpoint_router, profiler_router
 from src.config import env_vars
+from src.database import QueryProfilerMiddleware, query_profiler
 
 
 def create_app() -> FastAPI:
@@ -26,6 +27,11 @@ def create_app() -> FastAPI:
     # include routers to the app instance
     server.include_router(user_router())
     server.include_router(secure_endpoint_router())
+    server.include_router(profiler_router())
+
+    # attribute database queries to the route serving the request
+    if query_profiler.enabled:
+        server.add_middleware(QueryProfilerMiddleware, profiler=query_profiler)
 
     return server
 
@@ -29,6 +29,12 @@ class EnvVars:
     def db_url(self) -> str:
         return self._get_env_var("PROD_DB_URL", "DEV_DB_URL")
 
+    @property
+    def shard_db_urls(self) -> list[str]:
+        """Connection strings of the databases users are sharded across. Defaults to the single database in db_url."""
+        urls = self._get_env_var("PROD_SHARD_DB_URLS", "DEV_SHARD_DB_URLS")
+        return [url.strip() for url in urls.split(",") if url.strip()] if urls else [self.db_url]
+
     @property
     def access_token_expiry_in_minutes(self) -> int:
         return int(self._get_env_var("PROD_ACCESS_TOKEN_EXPIRY_TIME_IN_MINUTES", "DEV_ACCESS_TOKEN_EXPIRY_TIME_IN_MINUTES"))
@@ -37,5 +43,18 @@ class EnvVars:
     def password_reset_token_expiry_in_minutes(self) -> int:
         return int(self._get_env_var("PROD_PASSWORD_RESET_TOKEN_EXPIRY_IN_MINUTES", "DEV_ACCESS_TOKEN_EXPIRY_TIME_IN_MINUTES"))
 
+    @property
+    def query_profiler_sample_rate(self) -> float:
+        """Fraction of requests (0 to 1) whose database queries are profiled. Profiling is disabled when unset."""
+        return float(self._get_env_var("PROD_QUERY_PROFILER_SAMPLE_RATE", "DEV_QUERY_PROFILER_SAMPLE_RATE") or 0)
+
+    @property
+    def slow_query_threshold_ms(self) -> float:
+        return float(self._get_env_var("PROD_SLOW_QUERY_THRESHOLD_MS", "DEV_SLOW_QUERY_THRESHOLD_MS") or 200)
+
+    @property
+    def explain_slow_queries(self) -> bool:
+        return (self._get_env_var("PROD_EXPLAIN_SLOW_QUERIES", "DEV_EXPLAIN_SLOW_QUERIES") or "false").lower() == "true"
+
 
 env_vars = EnvVars(running_in_production=False)
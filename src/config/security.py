@@ -6,9 +6,8 @@ from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
 from loguru import logger
-from src.database import User, get_db
+from src.database import User, UserDirectory, get_db
 from .env_vars import env_vars
 
 class AccessTokenPurpose(str, enum.Enum):
@@ -46,9 +45,15 @@ class Security:
 
     @staticmethod
     async def get_user_by_email(email: str, db: AsyncSession) -> User | None:
-        """Function to retrieve a user by id."""
-        db_results = await db.execute(select(User).where(User.email == email))
-        user=db_results.scalars().one_or_none()
+        """Function to retrieve a user by email."""
+        # users are sharded by id - the directory maps the email to the id, which locates the user's shard
+        directory_entry = await db.get(UserDirectory, email)
+        if directory_entry is None:
+            return None
+        user = await db.get(User, directory_entry.user_id)
+        # the entry may be a claim held for a registration or email change that is in flight or failed
+        if user is None or user.email != email:
+            return None
         return user
 
     async def authenticate_user(self, email: str, password: str, db: AsyncSession) -> User | bool:
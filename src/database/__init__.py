@@ -1,2 +1,4 @@
-from .models import Base, User
-from .setup import get_db
\ No newline at end of file
+from .models import Base, User, UserChange, UserChangeOperation, UserDirectory
+from .setup import get_db, query_profiler, SessionLocal, shard_router, scatter_gather
+from .profiler import QueryProfilerMiddleware
+from .sharding import byte_order
\ No newline at end of file
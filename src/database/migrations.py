@@ -0,0 +1,206 @@
+"""
+Helpers for online schema and data migrations.
+
+Alembic runs every revision inside a transaction, so a large backfill or index build holds locks on the table until
+the whole revision finishes. The helpers below are called from revision scripts and step outside that transaction:
+indexes are built concurrently and backfills are applied in small keyset-ordered batches, each committed on its own,
+with a checkpoint recorded after every batch so an interrupted migration resumes where it stopped.
+
+A revision that uses these helpers is not atomic: they commit the revision's transaction, including any DDL that ran
+before them, and a revision is only stamped once it completes. Put the helpers in a revision of their own, after the
+revision making the schema change, so that re-running `alembic upgrade head` after an interruption only repeats the
+idempotent helpers. Example revisions::
+
+    # revision 1 - the schema change, applied atomically
+    from alembic import op
+    import sqlalchemy as sa
+
+    def upgrade() -> None:
+        op.add_column("users", sa.Column("email_verified", sa.Boolean(), nullable=True))
+
+    # revision 2 - the backfill and index, safe to re-run
+    from alembic import op
+    import sqlalchemy as sa
+    from src.database.migrations import batched_backfill, create_index_concurrently
+
+    def upgrade() -> None:
+        users = sa.table("users", sa.column("id", sa.String), sa.column("email_verified", sa.Boolean))
+        batched_backfill(
+            "users_email_verified_backfill",
+            users,
+            values={"email_verified": False},
+            where=users.c.email_verified.is_(None),
+        )
+        create_index_concurrently("ix_users_email_verified", "users", ["email_verified"])
+"""
+import datetime
+import time
+
+import sqlalchemy as sa
+from alembic import op
+from loguru import logger
+from sqlalchemy.exc import OperationalError
+
+from .models import MigrationCheckpoint
+
+checkpoints = MigrationCheckpoint.__table__
+
+
+def _require_online() -> None:
+    """Function to ensure the migration is running against a live database connection."""
+    if op.get_context().as_sql:
+        raise RuntimeError("Online migrations need a database connection and cannot run in offline (--sql) mode")
+
+
+def create_index_concurrently(index_name: str, table_name: str, columns: list[str], unique: bool = False, **kw) -> None:
+    """
+    Function to build an index without blocking writes to the table.
+
+    On PostgreSQL the index is built with CREATE INDEX CONCURRENTLY, which cannot run inside a transaction, so the
+    revision's transaction is committed first. A failed concurrent build leaves an invalid index behind; it is
+    dropped and rebuilt when the migration is retried.
+    """
+    _require_online()
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        if bind.dialect.name == "postgresql":
+            invalid = bind.execute(
+                sa.text(
+                    "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                    "WHERE c.relname = :name AND NOT i.indisvalid"
+                ),
+                {"name": index_name},
+            ).first()
+            if invalid:
+                logger.warning(f"Dropping invalid index {index_name} left by an interrupted build")
+                op.drop_index(index_name, table_name=table_name, postgresql_concurrently=True, if_exists=True)
+        op.create_index(
+            index_name, table_name, columns, unique=unique, postgresql_concurrently=True, if_not_exists=True, **kw
+        )
+
+
+def drop_index_concurrently(index_name: str, table_name: str) -> None:
+    """Function to drop an index without blocking reads and writes to the table."""
+    _require_online()
+    with op.get_context().autocommit_block():
+        op.drop_index(index_name, table_name=table_name, postgresql_concurrently=True, if_exists=True)
+
+
+def _load_checkpoint(bind, name: str) -> sa.Row | None:
+    return bind.execute(sa.select(checkpoints).where(checkpoints.c.name == name)).first()
+
+
+def _save_checkpoint(bind, name: str, last_key, rows_processed: int, completed: bool = False) -> None:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    values = {
+        "last_key": None if last_key is None else str(last_key),
+        "rows_processed": rows_processed,
+        "completed_at": now if completed else None,
+        "updated_at": now,
+    }
+    updated = bind.execute(sa.update(checkpoints).where(checkpoints.c.name == name).values(**values))
+    if updated.rowcount == 0:
+        bind.execute(sa.insert(checkpoints).values(name=name, **values))
+
+
+def batched_backfill(
+        name: str,
+        table: sa.TableClause,
+        values: dict,
+        where: sa.ColumnElement[bool] | None = None,
+        key: str = "id",
+        batch_size: int = 1000,
+        pause_seconds: float = 0.1,
+        lock_timeout: str = "5s",
+        max_retries: int = 5,
+) -> int:
+    """
+    Function to update rows in bounded batches ordered by a unique key, committing after each batch.
+
+    - `name` identifies the backfill's checkpoint, so it must be unique across revisions.
+    - `where` should exclude rows that were already backfilled. A batch interrupted between its update and its
+      checkpoint is then harmlessly applied again on resume.
+    - `pause_seconds` throttles the backfill between batches to leave headroom for the API and replicas.
+    - On PostgreSQL each batch gives up waiting for row locks after `lock_timeout` and is retried, rather than
+      queueing behind (and in front of) application traffic.
+
+    Returns the total number of rows updated by the backfill.
+    """
+    _require_online()
+    key_column = table.c[key]
+    key_type = key_column.type.python_type
+
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        is_postgres = bind.dialect.name == "postgresql"
+
+        checkpoint = _load_checkpoint(bind, name)
+        if checkpoint is not None and checkpoint.completed_at is not None:
+            logger.info(f"Backfill {name} already completed ({checkpoint.rows_processed} rows), skipping")
+            return checkpoint.rows_processed
+
+        last_key = key_type(checkpoint.last_key) if checkpoint and checkpoint.last_key is not None else None
+        rows_processed = checkpoint.rows_processed if checkpoint else 0
+
+        count_query = sa.select(sa.func.count()).select_from(table)
+        if where is not None:
+            count_query = count_query.where(where)
+        remaining = bind.execute(count_query).scalar_one()
+        if last_key is not None:
+            logger.info(f"Resuming backfill {name} after key {last_key} ({rows_processed} rows already processed)")
+        logger.info(f"Backfill {name}: {remaining} rows to update in batches of {batch_size}")
+
+        if is_postgres:
+            bind.execute(sa.text(f"SET lock_timeout = '{lock_timeout}'"))
+
+        started = time.monotonic()
+        updated_this_run = 0
+        try:
+            while True:
+                # keyset pagination keeps every batch an index range scan, however far into the table we are
+                batch_query = sa.select(key_column).order_by(key_column).limit(batch_size)
+                if where is not None:
+                    batch_query = batch_query.where(where)
+                if last_key is not None:
+                    batch_query = batch_query.where(key_column > last_key)
+                keys = bind.execute(batch_query).scalars().all()
+                if not keys:
+                    break
+
+                update = sa.update(table).where(key_column >= keys[0], key_column <= keys[-1]).values(**values)
+                if where is not None:
+                    update = update.where(where)
+
+                for attempt in range(1, max_retries + 1):
+                    try:
+                        updated = bind.execute(update).rowcount
+                        break
+                    except OperationalError as e:
+                        if attempt == max_retries:
+                            raise
+                        logger.warning(f"Backfill {name} batch failed (attempt {attempt}/{max_retries}): {str(e)}")
+                        time.sleep(pause_seconds * 2 ** attempt)
+
+                last_key = keys[-1]
+                rows_processed += updated
+                updated_this_run += updated
+                _save_checkpoint(bind, name, last_key, rows_processed)
+
+                elapsed = time.monotonic() - started
+                rate = updated_this_run / elapsed if elapsed else 0
+                eta = (remaining - updated_this_run) / rate if rate else 0
+                logger.info(
+                    f"Backfill {name}: {updated_this_run}/{remaining} rows "
+                    f"({updated_this_run / remaining:.1%}), {rate:.0f} rows/s, ~{eta:.0f}s remaining"
+                    if remaining else f"Backfill {name}: {updated_this_run} rows"
+                )
+
+                if pause_seconds:
+                    time.sleep(pause_seconds)
+        finally:
+            if is_postgres:
+                bind.execute(sa.text("RESET lock_timeout"))
+
+        _save_checkpoint(bind, name, last_key, rows_processed, completed=True)
+        logger.info(f"Backfill {name} completed: {rows_processed} rows in {time.monotonic() - started:.1f}s")
+        return rows_processed
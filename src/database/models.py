@@ -1,6 +1,7 @@
 import datetime
+import enum
 import shortuuid
-from sqlalchemy import Column, String, Date, JSON
+from sqlalchemy import Column, String, Date, DateTime, JSON, BigInteger, Integer
 from sqlalchemy.ext.declarative import declarative_base
 
 # Define base class for which all database models will inherit from
@@ -24,3 +25,60 @@ class User(Base):
     description = Column(String(255), nullable=True)
     created_at = Column(Date, nullable=False, default=datetime.datetime.now)
     updated_at = Column(Date, nullable=False, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+
+class UserDirectory(Base):
+    """
+    Maps a user's email to their id.
+
+    This class maps to the 'user_directory' table. Users are sharded by id, so logins look up the id here first to
+    find the shard holding the user. The primary key also keeps emails unique across all shards.
+    """
+    __tablename__ = "user_directory"
+
+    email = Column(String(255), primary_key=True)
+    user_id = Column(String(22), nullable=False)
+    # when the email was claimed - a claim with no user behind it may only be taken over once it is old enough that
+    # the registration or update that made it has finished
+    reserved_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.datetime.now(datetime.timezone.utc))
+
+
+class UserChangeOperation(str, enum.Enum):
+    """Represent the possible mutations recorded in the user change feed."""
+    CREATED = "CREATED"
+    UPDATED = "UPDATED"
+    DELETED = "DELETED"
+    MOVED = "MOVED"  # the user moved to another shard, whose feed continues with their changes
+
+
+class UserChange(Base):
+    """
+    Represents a single mutation of a user in the change feed outbox.
+
+    This class maps to the 'user_changes' table. Rows are written in the same transaction as the mutation they
+    describe and are ordered by a monotonically increasing sequence that consumers use to resume syncing.
+    """
+    __tablename__ = "user_changes"
+
+    # sqlite only auto increments INTEGER primary keys
+    sequence = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    user_id = Column(String(22), nullable=False, index=True)  # earlier snapshots are erased by user on deletion
+    operation = Column(String(10), nullable=False)
+    payload = Column(JSON, nullable=True)  # snapshot of the user after the change, empty for deletions and moves
+    created_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.datetime.now(datetime.timezone.utc))
+
+
+class MigrationCheckpoint(Base):
+    """
+    Represents the progress of a batched online data migration.
+
+    This class maps to the 'online_migration_checkpoints' table and lets an interrupted backfill resume from the
+    last key it processed instead of starting over.
+    """
+    __tablename__ = "online_migration_checkpoints"
+
+    name = Column(String(255), primary_key=True)
+    last_key = Column(String(255), nullable=True)
+    rows_processed = Column(BigInteger, nullable=False, default=0)
+    completed_at = Column(DateTime(timezone=True), nullable=True)
+    updated_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.datetime.now(datetime.timezone.utc))
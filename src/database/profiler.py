@@ -0,0 +1,245 @@
+import asyncio
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+
+from loguru import logger
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+
+class RequestQueryLog:
+    """Holds the statements issued by the database while serving a single sampled request."""
+
+    def __init__(self) -> None:
+        self.active = True  # cleared for requests whose statements are not attributed to them, such as streams
+        self.query_count = 0
+        self.total_time_ms = 0.0
+        self.slow_queries = 0
+        # statements are keyed by the database they ran on, so the same select sent to every shard is not a repeat
+        self.statements: Counter = Counter()  # (database, statement text) -> number of executions
+        self.identical: Counter = Counter()  # (database, statement text, parameters) -> number of executions
+
+    def record(self, database, statement: str, parameters, duration_ms: float, slow: bool) -> None:
+        """Function to record an executed statement against the request."""
+        if not self.active:
+            return
+        self.query_count += 1
+        self.total_time_ms += duration_ms
+        self.statements[(database, statement)] += 1
+        self.identical[(database, statement, repr(parameters))] += 1
+        if slow:
+            self.slow_queries += 1
+
+    def repeated_statements(self) -> dict[str, int]:
+        """Function to get statements executed more than once on the same database with identical parameters."""
+        return {statement: count for (_, statement, _), count in self.identical.items() if count > 1}
+
+    def frequent_statements(self, threshold: int) -> dict[str, int]:
+        """Function to get statements executed at least `threshold` times on the same database."""
+        return {statement: count for (_, statement), count in self.statements.items() if count >= threshold}
+
+
+class EndpointQueryStats:
+    """Aggregated query statistics for a single endpoint across all sampled requests."""
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.queries = 0
+        self.max_queries = 0
+        self.total_time_ms = 0.0
+        self.slow_queries = 0
+        self.requests_with_repeats = 0
+        self.requests_with_n_plus_one = 0
+
+    def as_dict(self) -> dict:
+        """Function to format the endpoint statistics for reporting."""
+        return {
+            "sampled_requests": self.requests,
+            "total_queries": self.queries,
+            "avg_queries_per_request": round(self.queries / self.requests, 2) if self.requests else 0,
+            "max_queries_per_request": self.max_queries,
+            "avg_db_time_ms": round(self.total_time_ms / self.requests, 2) if self.requests else 0,
+            "slow_queries": self.slow_queries,
+            "requests_with_repeated_queries": self.requests_with_repeats,
+            "requests_with_n_plus_one": self.requests_with_n_plus_one,
+        }
+
+
+class QueryProfiler:
+    """
+    Profiles the statements issued through the database engine and attributes them to the current route.
+
+    Only a sample of requests is profiled; for requests that are not sampled the engine hooks return immediately,
+    which keeps the overhead low enough to leave the profiler enabled in production.
+    """
+
+    # per-request query log, only set while a sampled request is being served
+    _current: ContextVar[RequestQueryLog | None] = ContextVar("current_request_query_log", default=None)
+
+    def __init__(
+            self,
+            sample_rate: float = 0.0,
+            slow_query_threshold_ms: float = 200.0,
+            explain_slow_queries: bool = False,
+            n_plus_one_threshold: int = 5,
+    ) -> None:
+        self.sample_rate = sample_rate
+        self.slow_query_threshold_ms = slow_query_threshold_ms
+        self.explain_slow_queries = explain_slow_queries
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self._endpoints: dict[str, EndpointQueryStats] = defaultdict(EndpointQueryStats)
+        self._lock = threading.Lock()
+        self._async_engines: dict = {}  # sync engine -> async engine, for running plan lookups
+        self._pending_explains: dict[str, asyncio.Task] = {}  # statement -> running plan lookup
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0
+
+    def attach(self, engine: AsyncEngine) -> None:
+        """Function to register the profiling hooks on the engine."""
+        sync_engine = engine.sync_engine
+        self._async_engines[sync_engine] = engine
+        event.listen(sync_engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def start_request(self) -> RequestQueryLog | None:
+        """Function to decide whether the current request is sampled and begin collecting its statements."""
+        if not self.enabled or random.random() >= self.sample_rate:
+            return None
+        query_log = RequestQueryLog()
+        self._current.set(query_log)
+        return query_log
+
+    def finish_request(self, endpoint: str, query_log: RequestQueryLog) -> None:
+        """Function to fold a finished request's statements into the per-endpoint statistics."""
+        self._current.set(None)
+        if not query_log.active:
+            return
+
+        repeated = query_log.repeated_statements()
+        n_plus_one = query_log.frequent_statements(self.n_plus_one_threshold)
+
+        with self._lock:
+            stats = self._endpoints[endpoint]
+            stats.requests += 1
+            stats.queries += query_log.query_count
+            stats.max_queries = max(stats.max_queries, query_log.query_count)
+            stats.total_time_ms += query_log.total_time_ms
+            stats.slow_queries += query_log.slow_queries
+            stats.requests_with_repeats += bool(repeated)
+            stats.requests_with_n_plus_one += bool(n_plus_one)
+
+        for statement, count in repeated.items():
+            logger.warning(f"[{endpoint}] identical statement executed {count} times: {statement}")
+        for statement, count in n_plus_one.items():
+            logger.warning(f"[{endpoint}] possible N+1 query, statement executed {count} times: {statement}")
+        logger.debug(
+            f"[{endpoint}] issued {query_log.query_count} queries in {query_log.total_time_ms:.2f}ms"
+        )
+
+    def report(self) -> dict[str, dict]:
+        """Function to get a summary of the query statistics for every profiled endpoint."""
+        with self._lock:
+            return {endpoint: stats.as_dict() for endpoint, stats in sorted(self._endpoints.items())}
+
+    def reset(self) -> None:
+        """Function to clear the collected statistics."""
+        with self._lock:
+            self._endpoints.clear()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        if self._current.get() is None:
+            return
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        query_log = self._current.get()
+        if query_log is None or not conn.info.get("query_start_time"):
+            return
+        duration_ms = (time.perf_counter() - conn.info["query_start_time"].pop()) * 1000
+        slow = duration_ms >= self.slow_query_threshold_ms
+        query_log.record(conn.engine.url, statement, parameters, duration_ms, slow)
+
+        if slow:
+            # parameters are not logged as they can hold emails and password hashes
+            logger.warning(f"Slow query ({duration_ms:.2f}ms): {statement}")
+            if self.explain_slow_queries:
+                self._schedule_explain(conn, statement, parameters)
+
+    def _schedule_explain(self, conn, statement: str, parameters) -> None:
+        """Function to look up the execution plan of a slow query in the background, off the request's path."""
+        # EXPLAIN ANALYZE executes the statement, so only read-only statements are re-run
+        if conn.dialect.name != "postgresql" or not statement.lstrip().upper().startswith("SELECT"):
+            return
+        # explain each statement once at a time, so a burst of the same slow query does not add to the load
+        if statement in self._pending_explains:
+            return
+        async_engine = self._async_engines.get(conn.engine)
+        if async_engine is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._pending_explains[statement] = loop.create_task(self._explain(async_engine, statement, parameters))
+
+    async def _explain(self, engine: AsyncEngine, statement: str, parameters) -> None:
+        """Function to log the execution plan of a slow query, using its own connection and transaction."""
+        # the task inherits the request's context - detach it so the plan lookup is not counted against the request
+        self._current.set(None)
+        try:
+            async with engine.connect() as conn:
+                db_results = await conn.exec_driver_sql(f"EXPLAIN ANALYZE {statement}", parameters)
+                plan = "\n".join(row[0] for row in db_results.all())
+                await conn.rollback()
+            logger.warning(f"Query plan for slow query:\n{plan}")
+        except Exception as e:
+            logger.error(f"Could not explain slow query: {str(e)}")
+        finally:
+            self._pending_explains.pop(statement, None)
+
+
+def _is_event_stream(message) -> bool:
+    """Function to check whether a response start message begins a Server-Sent Events stream."""
+    return any(
+        name.lower() == b"content-type" and value.startswith(b"text/event-stream")
+        for name, value in message.get("headers", [])
+    )
+
+
+class QueryProfilerMiddleware:
+    """ASGI middleware that attributes the statements issued while serving a request to its route."""
+
+    def __init__(self, app, profiler: QueryProfiler) -> None:
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        query_log = self.profiler.start_request()
+        if query_log is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message) -> None:
+            if message["type"] == "http.response.start" and _is_event_stream(message):
+                # A Server-Sent Events stream polls the database for as long as the client stays connected. Its polls
+                # would pile up in one query log and be reported as repeated and N+1 queries, so it is not profiled.
+                query_log.active = False
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # the router stores the matched route in the scope, giving the templated path e.g. /api/v1/users/{user_id}.
+            # Requests no route matched share one key, so scanned URLs do not grow the statistics without bound.
+            route = scope.get("route")
+            path = getattr(route, "path", "<unmatched>")
+            self.profiler.finish_request(f"{scope['method']} {path}", query_log)
@@ -0,0 +1,128 @@
+"""
+Moves users and email directory entries to the shard they hash to.
+
+Run after adding shard connection strings to DEV_SHARD_DB_URLS / PROD_SHARD_DB_URLS (and migrating the new databases):
+
+    python -m src.database.rebalance --dry-run
+    python -m src.database.rebalance --batch-size 500
+
+Rows are copied to their new shard before they are deleted from the old one, and rows that an interrupted run already
+copied are skipped, so the tool can be re-run safely. Until it completes, users that have not been moved yet cannot
+be found by id.
+
+A moved user is recorded as UPDATED in the change feed of their new shard and as MOVED in the feed of the shard they
+left. A directory entry whose email was meanwhile claimed for another user on its new shard is not moved; the conflict
+is logged for an operator to resolve.
+"""
+import argparse
+import asyncio
+
+from loguru import logger
+from sqlalchemy import delete, select
+from sqlalchemy.ext.horizontal_shard import set_shard_id
+
+from .models import Base, User, UserChangeOperation, UserDirectory
+from .setup import SessionLocal, shard_router
+from src.services.changes import change_feed_service
+
+
+def _copy(row: Base) -> Base:
+    """Function to create an unsaved copy of a row, which is routed to its shard when it is added to a session."""
+    model = type(row)
+    return model(**{column.name: getattr(row, column.name) for column in model.__table__.columns})
+
+
+async def _move_rows(model: type[Base], key: str, rows: list[Base], source_shard: int) -> int:
+    """Function to move rows from the source shard to the shards they hash to. Returns the rows moved."""
+    key_column = getattr(model, key)
+    keys = [getattr(row, key) for row in rows]
+    async with SessionLocal() as db:
+        # step 1: find the rows a previous run already copied to their new shards
+        copied = {}
+        for shard_id in shard_router.shard_ids:
+            if shard_id != source_shard:
+                db_results = await db.execute(
+                    select(model).where(key_column.in_(keys)).options(set_shard_id(shard_id))
+                )
+                copied.update((getattr(copy, key), copy) for copy in db_results.scalars().all())
+
+        # step 2: copy the remaining rows to their new shards
+        moved = []
+        for row in rows:
+            copy = copied.get(getattr(row, key))
+            if copy is None:
+                copy = _copy(row)
+                db.add(copy)
+                if model is User:
+                    # consumers of the new shard's change feed learn about the user from this entry
+                    await change_feed_service.record_user_change(db, copy, UserChangeOperation.UPDATED)
+            elif model is UserDirectory and copy.user_id != row.user_id:
+                # the email was claimed for another user on its new shard, e.g. by a registration made during the
+                # rebalance - both entries are kept for an operator to resolve
+                logger.error(
+                    f"Directory entry for {row.email} on shard {source_shard} belongs to user {row.user_id}, but "
+                    f"the entry on its new shard belongs to user {copy.user_id} - leaving both in place"
+                )
+                continue
+            moved.append(row)
+        await db.commit()
+        if not moved:
+            return 0
+
+        # step 3: remove the rows from the source shard once the copies are committed, recording each moved user in
+        # the source shard's change feed in the same transaction
+        await db.execute(
+            delete(model).where(key_column.in_([getattr(row, key) for row in moved])),
+            bind_arguments={"shard_id": source_shard},
+            execution_options={"synchronize_session": False},
+        )
+        if model is User:
+            for row in moved:
+                await change_feed_service.record_user_change(
+                    db, row, UserChangeOperation.MOVED, shard_id=source_shard
+                )
+        await db.commit()
+        return len(moved)
+
+
+async def rebalance_table(model: type[Base], key: str, route, batch_size: int = 500, dry_run: bool = False) -> int:
+    """Function to move every misplaced row of a table, scanning each shard in key order. Returns the rows moved."""
+    key_column = getattr(model, key)
+    moved = 0
+    for shard_id in shard_router.shard_ids:
+        last_key = None
+        while True:
+            query = select(model).order_by(key_column).limit(batch_size).options(set_shard_id(shard_id))
+            if last_key is not None:
+                query = query.where(key_column > last_key)
+            async with SessionLocal() as db:
+                db_results = await db.execute(query)
+                rows = list(db_results.scalars().all())
+            if not rows:
+                break
+            last_key = getattr(rows[-1], key)
+
+            misplaced = [row for row in rows if route(getattr(row, key)) != shard_id]
+            if misplaced and not dry_run:
+                moved += await _move_rows(model, key, misplaced, shard_id)
+            else:
+                moved += len(misplaced)
+
+        logger.info(f"{model.__tablename__}: scanned shard {shard_id}, {moved} rows {'to move' if dry_run else 'moved'} so far")
+    return moved
+
+
+async def rebalance(batch_size: int = 500, dry_run: bool = False) -> None:
+    """Function to move users and directory entries to the shards they hash to."""
+    logger.info(f"Rebalancing across {shard_router.shard_count} shards{' (dry run)' if dry_run else ''}")
+    users = await rebalance_table(User, "id", shard_router.shard_for_user_id, batch_size, dry_run)
+    emails = await rebalance_table(UserDirectory, "email", shard_router.shard_for_email, batch_size, dry_run)
+    logger.info(f"Rebalance complete: {users} users and {emails} directory entries {'to move' if dry_run else 'moved'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move users to the shard they hash to after adding shards.")
+    parser.add_argument("--batch-size", type=int, default=500, help="rows read from a shard at a time")
+    parser.add_argument("--dry-run", action="store_true", help="only report how many rows would move")
+    args = parser.parse_args()
+    asyncio.run(rebalance(batch_size=args.batch_size, dry_run=args.dry_run))
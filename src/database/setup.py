@@ -1,18 +1,52 @@
 
 
+import asyncio
+
+from sqlalchemy import Select, make_url
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, async_sessionmaker, AsyncSession
+from sqlalchemy.ext.horizontal_shard import ShardedSession, set_shard_id
 from ..config import env_vars
+from .profiler import QueryProfiler
+from .sharding import ShardRouter
+
+# configure an engine per shard to connect to the databases using the connection strings
+shard_engines: list[AsyncEngine] = [
+    create_async_engine(
+        url=url,
+        future=True,
+        # asyncpg only - other drivers, such as aiosqlite for local shards, reject the argument
+        connect_args={"statement_cache_size": 0} if make_url(url).get_driver_name() == "asyncpg" else {},
+        pool_pre_ping=True,  # ping the database before using a connection.
+    )
+    for url in env_vars.shard_db_urls
+]
+
+# the first shard - also the only database when sharding is not configured
+engine: AsyncEngine = shard_engines[0]
 
-# configure the engine to connect to the database using the connection string
-engine: AsyncEngine = create_async_engine(
-    url=env_vars.db_url,
-    future=True,
-    connect_args={"statement_cache_size": 0},
-    pool_pre_ping=True,  # ping the database before using a connection.
+# route users to shards by a hash of their id
+shard_router = ShardRouter(shard_count=len(shard_engines))
+
+# profile the statements issued per request - only a sample of requests is profiled
+query_profiler = QueryProfiler(
+    sample_rate=env_vars.query_profiler_sample_rate,
+    slow_query_threshold_ms=env_vars.slow_query_threshold_ms,
+    explain_slow_queries=env_vars.explain_slow_queries,
 )
+if query_profiler.enabled:
+    for shard_engine in shard_engines:
+        query_profiler.attach(shard_engine)
 
-# create a session local factory bound to the engine
-SessionLocal = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+# create a session local factory bound to the shard engines
+SessionLocal = async_sessionmaker(
+    sync_session_class=ShardedSession,
+    shards={shard_id: shard_engine.sync_engine for shard_id, shard_engine in enumerate(shard_engines)},
+    shard_chooser=shard_router.shard_chooser,
+    identity_chooser=shard_router.identity_chooser,
+    execute_chooser=shard_router.execute_chooser,
+    autoflush=False,
+    expire_on_commit=False,
+)
 
 # function to yield the session - will be used in routes as a dependency
 async def get_db():
@@ -20,3 +54,14 @@ async def get_db():
     async with SessionLocal() as session:
         yield session
 
+
+
+async def scatter_gather(statement: Select) -> list[list]:
+    """Function to run a select on every shard concurrently, returning the scalar results of each shard"""
+
+    async def run_on_shard(shard_id: int) -> list:
+        async with SessionLocal() as session:
+            db_results = await session.execute(statement.options(set_shard_id(shard_id)))
+            return list(db_results.scalars().all())
+
+    return await asyncio.gather(*(run_on_shard(shard_id) for shard_id in shard_router.shard_ids))
@@ -0,0 +1,145 @@
+import hashlib
+
+from sqlalchemy import String
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import ORMExecuteState
+from sqlalchemy.sql import operators, visitors
+from sqlalchemy.sql.expression import BindParameter, ColumnClause, FunctionElement
+
+from .models import User, UserChange, UserDirectory
+
+
+def jump_consistent_hash(key: int, num_buckets: int) -> int:
+    """
+    Function to map a 64-bit key to one of `num_buckets` buckets (Lamping & Veach, 2014).
+
+    When the number of buckets grows from N to N + 1 only about 1 / (N + 1) of the keys change bucket, which keeps
+    the number of rows moved by a rebalance to a minimum.
+    """
+    bucket, candidate = -1, 0
+    while candidate < num_buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) % 2 ** 64
+        candidate = int((bucket + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return bucket
+
+
+class byte_order(FunctionElement):
+    """
+    Compares a string column by its bytes, the order Python sorts strings in.
+
+    Results merged across shards in Python must come back from every shard in that order, whereas PostgreSQL orders
+    text by the database's collation, which may ignore case. SQLite already compares strings by their bytes.
+    """
+
+    type = String()
+    inherit_cache = True
+
+
+@compiles(byte_order)
+def _compile_byte_order(element, compiler, **kw) -> str:
+    return compiler.process(element.clauses, **kw)
+
+
+@compiles(byte_order, "postgresql")
+def _compile_byte_order_postgresql(element, compiler, **kw) -> str:
+    return f'{compiler.process(element.clauses, **kw)} COLLATE "C"'
+
+
+def _get_comparisons(statement, parameters: dict) -> list[tuple]:
+    """Function to extract the (column, operator, value) comparisons from a statement's where clause."""
+    whereclause = getattr(statement, "whereclause", None)
+    if whereclause is None:
+        return []
+
+    def bound_value(bind: BindParameter):
+        # primary key lookups such as session.get() pass their values as execution parameters
+        return parameters.get(bind.key, bind.effective_value)
+
+    comparisons = []
+    has_or = False
+
+    def visit_binary(binary) -> None:
+        if isinstance(binary.left, ColumnClause) and isinstance(binary.right, BindParameter):
+            comparisons.append((binary.left, binary.operator, bound_value(binary.right)))
+        elif isinstance(binary.left, BindParameter) and isinstance(binary.right, ColumnClause):
+            comparisons.append((binary.right, binary.operator, bound_value(binary.left)))
+
+    def visit_clauselist(clauselist) -> None:
+        nonlocal has_or
+        has_or = has_or or clauselist.operator is operators.or_
+
+    visitors.traverse(
+        whereclause,
+        {},
+        {"binary": visit_binary, "clauselist": visit_clauselist, "expression_clauselist": visit_clauselist},
+    )
+    # a comparison under OR does not restrict the rows to a single shard
+    return [] if has_or else comparisons
+
+
+class ShardRouter:
+    """
+    Routes rows to one of the shard databases.
+
+    - users and their change feed entries live on the shard chosen by a hash of the user id
+    - the email directory, which maps an email to a user id for logins and uniqueness checks, lives on the shard
+      chosen by a hash of the email
+    - anything else lives on the first shard
+    """
+
+    def __init__(self, shard_count: int) -> None:
+        self.shard_count = shard_count
+
+    @property
+    def shard_ids(self) -> list[int]:
+        return list(range(self.shard_count))
+
+    def shard_for_key(self, key: str) -> int:
+        """Function to get the shard a string key hashes to."""
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+        return jump_consistent_hash(int.from_bytes(digest, "big"), self.shard_count)
+
+    def shard_for_user_id(self, user_id: str) -> int:
+        return self.shard_for_key(user_id)
+
+    def shard_for_email(self, email: str) -> int:
+        return self.shard_for_key(email.lower())
+
+    def shard_chooser(self, mapper, instance, clause=None, **kw) -> int:
+        """Function to choose the shard a new row is written to."""
+        if isinstance(instance, User):
+            return self.shard_for_user_id(instance.id)
+        if isinstance(instance, UserChange):
+            return self.shard_for_user_id(instance.user_id)
+        if isinstance(instance, UserDirectory):
+            return self.shard_for_email(instance.email)
+        return 0
+
+    def identity_chooser(self, mapper, primary_key, **kw) -> list[int]:
+        """Function to choose the shards a row with the given primary key could live on."""
+        if mapper.class_ is User:
+            return [self.shard_for_user_id(primary_key[0])]
+        if mapper.class_ is UserDirectory:
+            return [self.shard_for_email(primary_key[0])]
+        return self.shard_ids
+
+    def execute_chooser(self, context: ORMExecuteState) -> list[int]:
+        """Function to choose the shards a statement runs on - every shard unless the criteria pin it down."""
+        shards = set()
+        parameters = context.parameters if isinstance(context.parameters, dict) else {}
+        for column, operator, value in _get_comparisons(context.statement, parameters):
+            if column.shares_lineage(User.__table__.c.id) or column.shares_lineage(UserChange.__table__.c.user_id):
+                route = self.shard_for_user_id
+            elif column.shares_lineage(UserDirectory.__table__.c.email):
+                route = self.shard_for_email
+            else:
+                continue
+
+            if value is None:
+                continue
+            if operator == operators.eq:
+                shards.add(route(value))
+            elif operator == operators.in_op:
+                shards.update(route(v) for v in value)
+        return sorted(shards) if shards else self.shard_ids
@@ -1 +1,2 @@
-from .users import create_users_router as user_router, create_secure_endpoint_router as secure_endpoint_router
\ No newline at end of file
+from .users import create_users_router as user_router, create_secure_endpoint_router as secure_endpoint_router
+from .profiler import create_profiler_router as profiler_router
\ No newline at end of file
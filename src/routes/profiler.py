@@ -0,0 +1,16 @@
+from fastapi import APIRouter, Depends, status
+
+from src.database import User, query_profiler
+from src.config.security import security
+
+
+def create_profiler_router() -> APIRouter:
+    """Function to create the database query profiling endpoints"""
+    router = APIRouter(prefix="/api/v1/profiler", tags=["Query Profiling"])
+
+    @router.get("/report", response_model=dict[str, dict], status_code=status.HTTP_200_OK)
+    async def get_query_report(user: User = Depends(security.get_current_user)) -> dict[str, dict]:
+        """Endpoint to retrieve a per-endpoint summary of the profiled database queries"""
+        return query_profiler.report()
+
+    return router
@@ -1,10 +1,13 @@
-from fastapi import APIRouter, Depends, status
+from fastapi import APIRouter, Depends, Header, Query, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database import get_db, User
 from src.schemas.users import TextResponse, NewUser, LoginResponse, UpdateUser, UserInfo
+from src.schemas.changes import UserChangesPage
 from src.services.users import user_service
+from src.services.changes import change_feed_service
 from src.config.security import security
 
 
@@ -37,11 +40,39 @@ def create_users_router() -> APIRouter:
         return response
 
     @router.get("/all", response_model=list[UserInfo], status_code=status.HTTP_200_OK)
-    async def get_all_users(start: int = 0, limit: int = 10, db: AsyncSession = Depends(get_db)) -> list[UserInfo]:
-        """Endpoint to retrieve all users - paginated"""
-        response = await user_service.handle_fetch_all_users(start=start, limit=limit, db=db)
+    async def get_all_users(start: int = 0, limit: int = 10, after: str | None = None) -> list[UserInfo]:
+        """Endpoint to retrieve all users - paginated, pass the last user's id as `after` to fetch the next page"""
+        response = await user_service.handle_fetch_all_users(start=start, limit=limit, after=after)
         return response
 
+    @router.get("/changes", response_model=UserChangesPage, status_code=status.HTTP_200_OK)
+    async def get_user_changes(
+            since: int = Query(default=0, ge=0),
+            limit: int = Query(default=100, ge=1, le=1000),
+            shard: int = Query(default=0, ge=0),
+            db: AsyncSession = Depends(get_db),
+            user: User = Depends(security.get_current_user),
+    ) -> UserChangesPage:
+        """Endpoint to retrieve the user changes recorded on a shard after a sequence - resume with `next_sequence`"""
+        response = await change_feed_service.handle_fetch_changes(db, since=since, limit=limit, shard=shard)
+        return response
+
+    @router.get("/changes/stream", status_code=status.HTTP_200_OK)
+    async def stream_user_changes(
+            since: int = Query(default=0, ge=0),
+            shard: int = Query(default=0, ge=0),
+            last_event_id: int | None = Header(default=None),
+            user: User = Depends(security.get_current_user),
+    ) -> StreamingResponse:
+        """Endpoint to stream a shard's user changes as Server-Sent Events - reconnecting clients resume from Last-Event-ID"""
+        change_feed_service.validate_shard(shard)
+        start = last_event_id if last_event_id is not None else since
+        return StreamingResponse(
+            change_feed_service.stream_changes(since=start, shard=shard),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
     @router.get("/user", response_model=UserInfo, status_code=status.HTTP_200_OK)
     async def get_user_by_id(user_id: str, db: AsyncSession = Depends(get_db)) -> UserInfo:
         """Endpoint to retrieve a user's information"""
@@ -0,0 +1,55 @@
+from datetime import datetime
+
+from pydantic import BaseModel
+
+from src.database.models import UserChangeOperation
+
+
+class UserChangeInfo(BaseModel):
+    """Used for formatting a single entry of the user change feed."""
+    sequence: int
+    user_id: str
+    operation: UserChangeOperation
+    payload: dict | None = None
+    created_at: datetime
+
+    model_config = {
+        "from_attributes": True,
+        "json_schema_extra": {
+            "example": {
+                "sequence": 42,
+                "user_id": "HCxFdfvYCBrK45sFTEo9wH",
+                "operation": "UPDATED",
+                "payload": {
+                    "id": "HCxFdfvYCBrK45sFTEo9wH",
+                    "email": "john.doe@gmail.com",
+                    "name": "John Doe",
+                    "dob": "1970-01-01",
+                    "address": None,
+                    "description": "A passionate software engineer",
+                    "created_at": "2025-06-29",
+                    "updated_at": "2025-07-01",
+                },
+                "created_at": "2025-07-01T08:30:00Z",
+            }
+        }
+    }
+
+
+class UserChangesPage(BaseModel):
+    """Used for formatting a page of the user change feed."""
+    changes: list[UserChangeInfo]
+    shard: int  # each shard has its own feed and sequence
+    shard_count: int
+    next_sequence: int  # pass as `since` to resume after the last change in this page
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "changes": [],
+                "shard": 0,
+                "shard_count": 1,
+                "next_sequence": 42,
+            }
+        }
+    }
@@ -98,6 +98,7 @@ class UpdateUser(BaseModel):
 
 
 class UserInfo(BaseModel):
+    id: str
     email: str
     name: str
     dob: date
@@ -108,6 +109,7 @@ class UserInfo(BaseModel):
         "from_attributes": True,
         "json_schema_extra": {
             "example": {
+                "id": "HCxFdfvYCBrK45sFTEo9wH",
                 "email": "<EMAIL>",
                 "name": "<NAME>",
                 "dob": "1970-01-01",
@@ -0,0 +1,124 @@
+import asyncio
+from typing import AsyncIterator
+
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import insert, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.horizontal_shard import set_shard_id
+from loguru import logger
+
+from src.database import User, UserChange, UserChangeOperation, SessionLocal, shard_router
+from src.schemas.changes import UserChangeInfo, UserChangesPage
+
+# arbitrary key for the advisory lock that serialises writers to the change feed
+CHANGE_FEED_LOCK_KEY = 2_027_001
+
+
+class ChangeFeedService:
+    """Class for recording and serving the user change feed"""
+
+    @staticmethod
+    async def record_user_change(
+            db: AsyncSession, user: User, operation: UserChangeOperation, shard_id: int | None = None
+    ) -> None:
+        """
+        Function to add a user mutation to the change feed outbox.
+
+        Must be called within the transaction that performs the mutation, before it is committed. Changes are
+        recorded on the user's shard, so each shard has its own feed and sequence, unless another shard is given -
+        a move is recorded on the shard the user left.
+        """
+        shard_id = shard_router.shard_for_user_id(user.id) if shard_id is None else shard_id
+        if db.get_bind(shard_id=shard_id).dialect.name == "postgresql":
+            # Sequence values are allocated on insert but become visible on commit. Holding a transaction level
+            # lock until commit keeps the two in the same order, so a consumer never skips a change that commits
+            # after a higher sequence has already been read.
+            await db.execute(
+                text("SELECT pg_advisory_xact_lock(:key)"),
+                {"key": CHANGE_FEED_LOCK_KEY},
+                bind_arguments={"shard_id": shard_id},
+            )
+
+        payload = None
+        if operation in (UserChangeOperation.DELETED, UserChangeOperation.MOVED):
+            # erase the personal data held in the user's earlier snapshots on the shard - consumers still see every
+            # change, and a moved user's data is carried on by the feed of their new shard
+            await db.execute(
+                update(UserChange).where(UserChange.user_id == user.id).values(payload=None),
+                bind_arguments={"shard_id": shard_id},
+                execution_options={"synchronize_session": False},
+            )
+        else:
+            payload = jsonable_encoder(
+                {column.name: getattr(user, column.name) for column in User.__table__.columns if column.name != "password"}
+            )
+        await db.execute(
+            insert(UserChange).values(user_id=user.id, operation=operation.value, payload=payload),
+            bind_arguments={"shard_id": shard_id},
+        )
+
+    @staticmethod
+    async def fetch_changes(db: AsyncSession, since: int = 0, limit: int = 100, shard: int = 0) -> list[UserChange]:
+        """Function to fetch the changes recorded on a shard after the given sequence, oldest first"""
+        db_results = await db.execute(
+            select(UserChange)
+            .where(UserChange.sequence > since)
+            .order_by(UserChange.sequence)
+            .limit(limit)
+            .options(set_shard_id(shard))
+        )
+        return list(db_results.scalars().all())
+
+    @staticmethod
+    def validate_shard(shard: int) -> None:
+        """Function to check that the requested shard exists"""
+        if shard >= shard_router.shard_count:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Shard {shard} does not exist. There are {shard_router.shard_count} shards.",
+            )
+
+    async def handle_fetch_changes(
+            self, db: AsyncSession, since: int = 0, limit: int = 100, shard: int = 0
+    ) -> UserChangesPage:
+        """Function to fetch a page of a shard's change feed"""
+        self.validate_shard(shard)
+        try:
+            changes = await self.fetch_changes(db, since=since, limit=limit, shard=shard)
+            return UserChangesPage(
+                changes=[UserChangeInfo.model_validate(change) for change in changes],
+                shard=shard,
+                shard_count=shard_router.shard_count,
+                next_sequence=changes[-1].sequence if changes else since,
+            )
+        except SQLAlchemyError as s:
+            logger.exception(f"SQLAlchemyError occurred: {str(s)}")
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Could not fetch changes. Please try again or contact support."
+            )
+
+    async def stream_changes(
+            self, since: int = 0, shard: int = 0, batch_size: int = 100, poll_interval_seconds: float = 1.0
+    ) -> AsyncIterator[str]:
+        """Function to stream a shard's change feed as Server-Sent Events, starting after the given sequence"""
+        while True:
+            # use a short-lived session per poll so the stream does not hold a connection while idle
+            async with SessionLocal() as db:
+                changes = await self.fetch_changes(db, since=since, limit=batch_size, shard=shard)
+
+            for change in changes:
+                data = UserChangeInfo.model_validate(change).model_dump_json()
+                yield f"id: {change.sequence}\nevent: {change.operation}\ndata: {data}\n\n"
+                since = change.sequence
+
+            if not changes:
+                # comment line keeps proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+            if len(changes) < batch_size:
+                await asyncio.sleep(poll_interval_seconds)
+
+
+change_feed_service = ChangeFeedService()
@@ -1,38 +1,46 @@
+import heapq
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+
+import shortuuid
 from fastapi import HTTPException, status
-from sqlalchemy import select
+from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from loguru import logger
 
 from src.config.security import security, AccessTokenPurpose
-from src.database import User
-from src.schemas.users import NewUser, TextResponse, LoginResponse, UpdateUser, UserInfo
+from src.database import SessionLocal, User, UserChangeOperation, UserDirectory, byte_order, scatter_gather
+from src.schemas.users import NewUser, TextResponse, LoginResponse, UpdateUser, UserInfo, UserFieldsEnum
+from src.services.changes import change_feed_service
+
+# a directory claim with no user behind it is only taken over after this long, so an in-flight request keeps its claim
+EMAIL_RESERVATION_TIMEOUT = timedelta(minutes=5)
 
 
 class UserService:
     """Class for user management business logic"""
 
-    @staticmethod
-    async def handle_create_user(new_user: NewUser, db: AsyncSession) -> TextResponse:
+    async def handle_create_user(self, new_user: NewUser, db: AsyncSession) -> TextResponse:
         """Function to persist new user to database"""
 
-        # step 1: Check if email is already taken
-        existing_user = await security.get_user_by_email(new_user.email, db)
-        if existing_user:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"User with email {new_user.email} already exists",
-            )
+        # step 1: Claim the email in the directory, which fails if it is already taken. The directory may live on
+        # another shard; the claim is committed first so a user is never left unreachable by email.
+        email = new_user.email
+        user_id = shortuuid.uuid()  # generated up front as it decides the user's shard
+        await self.reserve_email(email, user_id)
 
         try:
             # step 2: Create new user
-            new_user = User(**new_user.model_dump())
+            new_user = User(id=user_id, **new_user.model_dump())
 
             # step 3: Hash new user's password
             new_user.password = security.get_password_hash(new_user.password)
 
-            # step 4: Add new users data to db and commit changes to persist
+            # step 4: Add new users data to db, record the change and commit changes to persist
             db.add(new_user)
+            await db.flush()  # applies column defaults before the change is recorded
+            await change_feed_service.record_user_change(db, new_user, UserChangeOperation.CREATED)
             await db.commit()
             await db.refresh(new_user)
 
@@ -40,11 +48,13 @@ class UserService:
             return TextResponse(detail=f"User with email {new_user.email} created successfully")
         except SQLAlchemyError as s:
             logger.exception(f"SQLAlchemyError occurred: {str(s)}")
+            await self.abandon_email_reservation(email, user_id, db)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Could not create new user. Please try again or contact support.")
         except Exception as e:
             logger.exception(f"Unexpected error occurred: {str(e)}")
+            await self.abandon_email_reservation(email, user_id, db)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Could not create new user. Please try again or contact support.")
@@ -65,8 +75,7 @@ class UserService:
         response = LoginResponse(access_token=access_token, token_type="bearer")
         return response
 
-    @staticmethod
-    async def handle_update_user(updated_data: UpdateUser, db: AsyncSession) -> TextResponse:
+    async def handle_update_user(self, updated_data: UpdateUser, db: AsyncSession) -> TextResponse:
         """Function to update an existing user's data"""
         # step 1: retrieve user's data
         db_results = await db.execute(select(User).filter_by(id=updated_data.user_id))
@@ -74,38 +83,54 @@ class UserService:
         if not existing_user:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User does not exist")
 
+        # step 2: Claim a new email in the directory before the user is updated, so the user stays reachable
+        user_id = existing_user.id
+        email_changed = updated_data.field == UserFieldsEnum.email and updated_data.value != existing_user.email
+        previous_email = existing_user.email
+        if email_changed:
+            await self.reserve_email(updated_data.value, user_id)
+
         try:
-            # step 2: convert the updated data pydantic model to dict
+            # step 3: convert the updated data pydantic model to dict
             data_to_update = updated_data.model_dump(exclude_unset=True)
 
-            # Step 3: Update the user's data based on the new data fields and values
+            # Step 4: Update the user's data based on the new data fields and values
             if data_to_update["field"] in existing_user.__dict__:
                 logger.info("Updating existing user")
                 setattr(existing_user, data_to_update["field"], data_to_update["value"])
 
-            # step 4: add the data to the database and commit to persist changes
+            # step 5: add the data to the database, record the change and commit to persist changes
             db.add(existing_user)
+            await db.flush()  # applies onupdate defaults before the change is recorded
+            await change_feed_service.record_user_change(db, existing_user, UserChangeOperation.UPDATED)
             await db.commit()
             await db.refresh(existing_user)
 
-            # step 5: format the confirmation response
+            # step 6: release the previous email once the user no longer uses it
+            if email_changed:
+                await self.release_email(previous_email, user_id, db)
+
+            # step 7: format the confirmation response
             return TextResponse(
                 detail=f"{data_to_update['field'].value} updated successfully to "
                        f"{getattr(existing_user, data_to_update['field'])}"
             )
         except SQLAlchemyError as s:
             logger.exception(f"SQLAlchemyError occurred: {str(s)}")
+            if email_changed:
+                await self.abandon_email_reservation(updated_data.value, user_id, db)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Could not update user. Please try again or contact support.")
         except Exception as e:
             logger.exception(f"Unexpected error occurred: {str(e)}")
+            if email_changed:
+                await self.abandon_email_reservation(updated_data.value, user_id, db)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Could not update user. Please try again or contact support.")
 
-    @staticmethod
-    async def handle_remove_user(user_id: str, db: AsyncSession) -> TextResponse:
+    async def handle_remove_user(self, user_id: str, db: AsyncSession) -> TextResponse:
         """Function to remove a logged-in user"""
 
         # step 1: Check if user exists
@@ -114,10 +139,12 @@ class UserService:
         if not user_info:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User does not exist")
 
-        # step 2: remove user from db if they exist
+        # step 2: remove user from db if they exist, record the change and release their email
         try:
             await db.delete(user_info)
+            await change_feed_service.record_user_change(db, user_info, UserChangeOperation.DELETED)
             await db.commit()
+            await self.release_email(user_info.email, user_id, db)
 
             # step 3: format the confirmation message
             return TextResponse(detail=f"User with id {user_id} removed successfully")
@@ -134,6 +161,74 @@ class UserService:
                 detail="Could not remove user. Please try again or contact support."
             )
 
+    @staticmethod
+    async def reserve_email(email: str, user_id: str) -> None:
+        """
+        Function to claim an email in the directory for a user, raising an error if it is taken.
+
+        The claim is committed in a session of its own, so a rejected claim never rolls back the caller's session.
+        """
+        async with SessionLocal() as db:
+            try:
+                # the directory's primary key rejects an email that is taken, including by a concurrent request
+                db.add(UserDirectory(email=email, user_id=user_id))
+                await db.commit()
+                return
+            except IntegrityError:
+                await db.rollback()
+
+            try:
+                # A claim whose user does not hold the email was left by a failed registration or update. It is
+                # taken over only once it is old enough for that request to have finished, and only if it is still
+                # the same claim - the conditional update loses to a concurrent takeover.
+                entry = await db.get(UserDirectory, email)
+                holder = await db.get(User, entry.user_id) if entry else None
+                if entry is not None and (holder is None or holder.email != email):
+                    now = datetime.now(timezone.utc)
+                    db_results = await db.execute(
+                        update(UserDirectory)
+                        .where(
+                            UserDirectory.email == email,
+                            UserDirectory.user_id == entry.user_id,
+                            UserDirectory.reserved_at < now - EMAIL_RESERVATION_TIMEOUT,
+                        )
+                        .values(user_id=user_id, reserved_at=now),
+                        execution_options={"synchronize_session": False},
+                    )
+                    if db_results.rowcount == 1:
+                        await db.commit()
+                        return
+            except SQLAlchemyError as s:
+                logger.exception(f"SQLAlchemyError occurred: {str(s)}")
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail="Could not reserve email. Please try again or contact support."
+                )
+
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"User with email {email} already exists",
+        )
+
+    async def abandon_email_reservation(self, email: str, user_id: str, db: AsyncSession) -> None:
+        """Function to release an email claimed for a registration or update that failed"""
+        try:
+            await db.rollback()
+            # the failure may have happened after the user was committed with the email, in which case it stays
+            user = await db.get(User, user_id, populate_existing=True)
+            if user is None or user.email != email:
+                await self.release_email(email, user_id, db)
+        except SQLAlchemyError as s:
+            logger.exception(f"Could not release email reservation: {str(s)}")
+
+    @staticmethod
+    async def release_email(email: str, user_id: str, db: AsyncSession) -> None:
+        """Function to remove an email that the user no longer uses from the directory"""
+        directory_entry = await db.get(UserDirectory, email)
+        if directory_entry is not None and directory_entry.user_id == user_id:
+            await db.delete(directory_entry)
+            await db.commit()
+
     @staticmethod
     async def handle_get_user_by_id(user_id: str, db: AsyncSession) -> UserInfo:
         """Function to fetch a user's information"""
@@ -154,12 +249,20 @@ class UserService:
             )
 
     @staticmethod
-    async def handle_fetch_all_users(db: AsyncSession, start: int = 0, limit: int = 10) -> list[UserInfo]:
-        """Function to fetch all users"""
+    async def handle_fetch_all_users(start: int = 0, limit: int = 10, after: str | None = None) -> list[UserInfo]:
+        """Function to fetch all users, ordered by id"""
         try:
             logger.info("Fetching all users")
-            db_results = await db.execute(select(User).offset(start).limit(limit))
-            results = db_results.scalars().all()
+
+            # step 1: fetch the first start + limit users after the cursor from every shard concurrently. The shards
+            # order ids by their bytes, as the merge below does, whatever the database's collation.
+            query = select(User).order_by(byte_order(User.id)).limit(start + limit)
+            if after is not None:
+                query = query.where(byte_order(User.id) > after)
+            shard_results = await scatter_gather(query)
+
+            # step 2: merge the per-shard pages, which are already ordered by id, and cut out the requested page
+            results = islice(heapq.merge(*shard_results, key=lambda user: user.id), start, start + limit)
             users_response = [
                 UserInfo(**result.__dict__) for result in results
             ]
@@ -0,0 +1,42 @@
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+# the shard engines are created when src.database is imported, so the shard databases are configured first
+SHARD_COUNT = 3
+_shard_dir = tempfile.mkdtemp(prefix="shards-")
+os.environ["DEV_SHARD_DB_URLS"] = ",".join(
+    f"sqlite+aiosqlite:///{_shard_dir}/shard{shard_id}.db" for shard_id in range(SHARD_COUNT)
+)
+
+from src.database import Base  # noqa: E402
+from src.database.setup import shard_engines  # noqa: E402
+
+
+def run(coroutine):
+    """Function to run a coroutine against the shards, closing their connections in the same event loop."""
+
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            for shard_engine in shard_engines:
+                await shard_engine.dispose()
+
+    return asyncio.run(main())
+
+
+@pytest.fixture(autouse=True)
+def shards():
+    """Recreate the tables on every shard before each test."""
+
+    async def reset() -> None:
+        for shard_engine in shard_engines:
+            async with shard_engine.begin() as conn:
+                await conn.run_sync(Base.metadata.drop_all)
+                await conn.run_sync(Base.metadata.create_all)
+
+    run(reset())
+    return shard_engines
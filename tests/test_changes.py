@@ -0,0 +1,120 @@
+import pytest
+from fastapi import HTTPException, status
+
+from conftest import SHARD_COUNT, run
+from src.config.security import security
+from src.database import SessionLocal, UserChangeOperation, shard_router
+from src.routes.users import create_users_router
+from src.schemas.users import NewUser, UpdateUser, UserFieldsEnum
+from src.services.changes import change_feed_service
+from src.services.users import user_service
+
+
+async def register(email: str) -> str:
+    async with SessionLocal() as db:
+        await user_service.handle_create_user(
+            NewUser(email=email, password="qwerty1234", name="John Doe", description=""), db
+        )
+        return (await security.get_user_by_email(email, db)).id
+
+
+async def rename(user_id: str, name: str) -> None:
+    async with SessionLocal() as db:
+        await user_service.handle_update_user(UpdateUser(user_id=user_id, field=UserFieldsEnum.name, value=name), db)
+
+
+async def remove(user_id: str) -> None:
+    async with SessionLocal() as db:
+        await user_service.handle_remove_user(user_id, db)
+
+
+async def fetch_page(shard: int, since: int = 0, limit: int = 100):
+    async with SessionLocal() as db:
+        return await change_feed_service.handle_fetch_changes(db, since=since, limit=limit, shard=shard)
+
+
+def test_each_mutation_records_one_change_on_the_users_shard():
+    user_id = run(register("john@example.com"))
+    run(rename(user_id, "Johnny Doe"))
+    run(remove(user_id))
+
+    shard = shard_router.shard_for_user_id(user_id)
+    changes = run(fetch_page(shard)).changes
+    assert [(change.user_id, change.operation) for change in changes] == [
+        (user_id, UserChangeOperation.CREATED),
+        (user_id, UserChangeOperation.UPDATED),
+        (user_id, UserChangeOperation.DELETED),
+    ]
+    sequences = [change.sequence for change in changes]
+    assert sequences == sorted(set(sequences))
+    for other_shard in set(range(SHARD_COUNT)) - {shard}:
+        assert run(fetch_page(other_shard)).changes == []
+
+
+def test_snapshots_exclude_the_password_and_are_erased_on_removal():
+    user_id = run(register("john@example.com"))
+    run(rename(user_id, "Johnny Doe"))
+    shard = shard_router.shard_for_user_id(user_id)
+
+    created, updated = run(fetch_page(shard)).changes
+    assert created.payload["email"] == "john@example.com" and "password" not in created.payload
+    assert updated.payload["name"] == "Johnny Doe"
+
+    run(remove(user_id))
+    assert [change.payload for change in run(fetch_page(shard)).changes] == [None, None, None]
+
+
+def test_pages_resume_after_the_given_sequence():
+    user_id = run(register("john@example.com"))
+    for n in range(4):
+        run(rename(user_id, f"John Doe {n}"))
+    shard = shard_router.shard_for_user_id(user_id)
+    all_sequences = [change.sequence for change in run(fetch_page(shard)).changes]
+
+    fetched, since = [], 0
+    while (page := run(fetch_page(shard, since=since, limit=2))).changes:
+        fetched += [change.sequence for change in page.changes]
+        since = page.next_sequence
+    assert fetched == all_sequences
+    # an empty page hands the cursor back unchanged
+    assert page.next_sequence == all_sequences[-1]
+    assert page.shard == shard and page.shard_count == SHARD_COUNT
+
+
+def test_unknown_shards_are_rejected():
+    with pytest.raises(HTTPException) as error:
+        run(fetch_page(SHARD_COUNT))
+    assert error.value.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def stream_route():
+    return next(route for route in create_users_router().routes if route.path == "/api/v1/users/changes/stream")
+
+
+async def read_events(since: int, shard: int, last_event_id: int | None, count: int) -> list[int]:
+    """Function to read the sequences of the first events streamed by the endpoint."""
+    response = await stream_route().endpoint(since=since, shard=shard, last_event_id=last_event_id, user=None)
+    events = []
+    try:
+        async for event in response.body_iterator:
+            if event.startswith("id: "):
+                events.append(int(event.split("\n")[0].removeprefix("id: ")))
+            if len(events) == count:
+                break
+    finally:
+        await response.body_iterator.aclose()
+    return events
+
+
+def test_stream_resumes_from_last_event_id():
+    user_id = run(register("john@example.com"))
+    run(rename(user_id, "Johnny Doe"))
+    run(rename(user_id, "Jonathan Doe"))
+    shard = shard_router.shard_for_user_id(user_id)
+    sequences = [change.sequence for change in run(fetch_page(shard)).changes]
+
+    assert run(read_events(since=0, shard=shard, last_event_id=None, count=3)) == sequences
+    assert run(read_events(since=sequences[0], shard=shard, last_event_id=None, count=2)) == sequences[1:]
+    # a reconnecting client's Last-Event-ID takes precedence over the since parameter
+    assert run(read_events(since=0, shard=shard, last_event_id=sequences[1], count=1)) == sequences[2:]
+    assert [param.alias for param in stream_route().dependant.header_params] == ["last-event-id"]
@@ -0,0 +1,121 @@
+import sqlite3
+
+import pytest
+import sqlalchemy as sa
+from alembic.operations import Operations
+from alembic.runtime.migration import MigrationContext
+from sqlalchemy.exc import OperationalError
+
+from src.database.migrations import batched_backfill, checkpoints
+
+metadata = sa.MetaData()
+items = sa.Table(
+    "items", metadata,
+    sa.Column("id", sa.Integer, primary_key=True),
+    sa.Column("flag", sa.Boolean, nullable=True),
+)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path}/migrations.db")
+    with engine.begin() as conn:
+        metadata.create_all(conn)
+        checkpoints.create(conn)
+        conn.execute(sa.insert(items), [{"id": n, "flag": None} for n in range(1, 11)])
+    yield engine
+    engine.dispose()
+
+
+def backfill(engine, **kw) -> int:
+    """Function to run the backfill inside a migration, the way a revision script calls it."""
+    with engine.connect() as conn:
+        context = MigrationContext.configure(conn)
+        with context.begin_transaction(), Operations.context(context):
+            return batched_backfill(
+                "items_flag_backfill", items, values={"flag": True}, where=items.c.flag.is_(None),
+                batch_size=3, pause_seconds=0, **kw
+            )
+
+
+def unflagged(engine) -> list[int]:
+    with engine.connect() as conn:
+        return list(conn.execute(sa.select(items.c.id).where(items.c.flag.is_(None)).order_by(items.c.id)).scalars())
+
+
+def checkpoint(engine):
+    with engine.connect() as conn:
+        return conn.execute(sa.select(checkpoints)).one()
+
+
+def test_backfill_updates_every_row_and_records_its_completion(engine):
+    assert backfill(engine) == 10
+    assert unflagged(engine) == []
+    saved = checkpoint(engine)
+    assert (saved.name, saved.last_key, saved.rows_processed) == ("items_flag_backfill", "10", 10)
+    assert saved.completed_at is not None
+
+
+def test_completed_backfills_are_skipped(engine):
+    backfill(engine)
+    with engine.begin() as conn:
+        conn.execute(sa.update(items).values(flag=None))
+
+    assert backfill(engine) == 10
+    assert unflagged(engine) == list(range(1, 11))
+
+
+def test_interrupted_backfills_resume_from_their_checkpoint(engine):
+    # an earlier run updated the first two batches before it was interrupted
+    with engine.begin() as conn:
+        conn.execute(sa.update(items).where(items.c.id <= 6).values(flag=True))
+        conn.execute(sa.insert(checkpoints).values(
+            name="items_flag_backfill", last_key="6", rows_processed=6, updated_at=sa.func.now()
+        ))
+
+    statements = []
+    sa.event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    assert backfill(engine) == 10
+    assert unflagged(engine) == []
+    # the resumed run starts after the checkpoint rather than rescanning the table
+    assert any("items.id > ?" in statement for statement in statements)
+    assert checkpoint(engine).rows_processed == 10
+
+
+def fail_updates(engine, failures: int) -> None:
+    """Function to make the next backfill updates fail as if they timed out waiting for a lock."""
+    remaining = [failures]
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        if statement.startswith("UPDATE items") and remaining[0]:
+            remaining[0] -= 1
+            raise OperationalError(statement, parameters, sqlite3.OperationalError("database is locked"))
+
+    sa.event.listen(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def test_failed_batches_are_retried(engine):
+    fail_updates(engine, failures=2)
+    assert backfill(engine, max_retries=3) == 10
+    assert unflagged(engine) == []
+
+
+def test_backfill_gives_up_after_max_retries_and_keeps_its_progress(engine):
+    backfill_batches = 2
+
+    def fail_after_batches(conn, cursor, statement, parameters, context, executemany) -> None:
+        nonlocal backfill_batches
+        if statement.startswith("UPDATE items"):
+            if backfill_batches == 0:
+                raise OperationalError(statement, parameters, sqlite3.OperationalError("database is locked"))
+            backfill_batches -= 1
+
+    sa.event.listen(engine, "before_cursor_execute", fail_after_batches)
+    with pytest.raises(OperationalError):
+        backfill(engine, max_retries=2)
+    sa.event.remove(engine, "before_cursor_execute", fail_after_batches)
+
+    saved = checkpoint(engine)
+    assert (saved.last_key, saved.rows_processed, saved.completed_at) == ("6", 6, None)
+    assert backfill(engine) == 10
+    assert unflagged(engine) == []
@@ -0,0 +1,44 @@
+import asyncio
+
+from src.database.profiler import QueryProfiler, QueryProfilerMiddleware
+
+
+def make_app(profiler: QueryProfiler, content_type: bytes, polls: int):
+    """Function to build an app that runs the same statement once per poll after starting its response."""
+
+    async def app(scope, receive, send) -> None:
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", content_type)]})
+        for _ in range(polls):
+            profiler._current.get().record("db", "SELECT * FROM user_changes", (0,), 1.0, slow=False)
+            await send({"type": "http.response.body", "body": b"data\n\n", "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    return app
+
+
+def serve(profiler: QueryProfiler, content_type: bytes, polls: int) -> None:
+    async def send(message) -> None:
+        pass
+
+    async def receive() -> dict:
+        return {"type": "http.request"}
+
+    middleware = QueryProfilerMiddleware(make_app(profiler, content_type, polls), profiler)
+    asyncio.run(middleware({"type": "http", "method": "GET"}, receive, send))
+
+
+def test_profiler_reports_repeated_statements_of_a_request():
+    profiler = QueryProfiler(sample_rate=1.0)
+    serve(profiler, b"application/json", polls=6)
+
+    stats = profiler.report()["GET <unmatched>"]
+    assert stats["total_queries"] == 6
+    assert stats["requests_with_repeated_queries"] == 1
+    assert stats["requests_with_n_plus_one"] == 1
+
+
+def test_profiler_skips_event_streams():
+    profiler = QueryProfiler(sample_rate=1.0)
+    serve(profiler, b"text/event-stream; charset=utf-8", polls=50)
+
+    assert profiler.report() == {}
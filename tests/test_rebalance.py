@@ -0,0 +1,116 @@
+import datetime
+
+from sqlalchemy import insert, select
+
+from conftest import run
+from src.database import SessionLocal, User, UserChange, UserChangeOperation, UserDirectory, shard_router
+from src.database.rebalance import rebalance, rebalance_table
+from src.database.setup import shard_engines
+
+
+def keys_for_shard(prefix: str, shard_id: int, route, count: int) -> list[str]:
+    """Function to find keys that hash to the given shard."""
+    keys, n = [], 0
+    while len(keys) < count:
+        key = f"{prefix}{n}"
+        if route(key) == shard_id:
+            keys.append(key)
+        n += 1
+    return keys
+
+
+async def insert_rows(shard_id: int, model, rows: list[dict]) -> None:
+    """Function to write rows straight to a shard, as they were placed before shards were added."""
+    async with shard_engines[shard_id].begin() as conn:
+        await conn.execute(insert(model.__table__), rows)
+
+
+async def select_all(shard_id: int, model) -> list:
+    async with shard_engines[shard_id].connect() as conn:
+        return list((await conn.execute(select(model.__table__))).all())
+
+
+def user_row(user_id: str) -> dict:
+    today = datetime.date.today()
+    return {
+        "id": user_id, "name": "John Doe", "email": f"{user_id}@example.com", "password": "hashed",
+        "dob": datetime.date(1990, 1, 1), "created_at": today, "updated_at": today,
+    }
+
+
+def directory_row(email: str, user_id: str) -> dict:
+    return {"email": email, "user_id": user_id, "reserved_at": datetime.datetime.now(datetime.timezone.utc)}
+
+
+def test_rebalance_moves_users_to_their_shard_and_records_the_move():
+    # every user starts on the first shard, as if the other shards were just added
+    user_ids = [f"user{n}" for n in range(20)]
+    assert {shard_router.shard_for_user_id(user_id) for user_id in user_ids} == set(shard_router.shard_ids)
+    run(insert_rows(0, User, [user_row(user_id) for user_id in user_ids]))
+    run(insert_rows(0, UserChange, [
+        {"user_id": user_id, "operation": "CREATED", "payload": {"id": user_id},
+         "created_at": datetime.datetime.now(datetime.timezone.utc)}
+        for user_id in user_ids
+    ]))
+
+    run(rebalance(batch_size=7))
+
+    for shard_id in shard_router.shard_ids:
+        on_shard = {row.id for row in run(select_all(shard_id, User))}
+        assert on_shard == {user_id for user_id in user_ids if shard_router.shard_for_user_id(user_id) == shard_id}
+
+    moved = {user_id for user_id in user_ids if shard_router.shard_for_user_id(user_id) != 0}
+    source_feed = run(select_all(0, UserChange))
+    assert {change.user_id for change in source_feed if change.operation == UserChangeOperation.MOVED} == moved
+    # the moved users' data is no longer held by the shard they left
+    assert all(change.payload is None for change in source_feed if change.user_id in moved)
+    for user_id in moved:
+        target_feed = run(select_all(shard_router.shard_for_user_id(user_id), UserChange))
+        assert [(change.operation, change.payload["id"]) for change in target_feed if change.user_id == user_id] == [
+            (UserChangeOperation.UPDATED, user_id)
+        ]
+
+    # a second run finds nothing to move
+    assert run(rebalance_table(User, "id", shard_router.shard_for_user_id)) == 0
+
+
+def test_rebalance_finishes_a_move_interrupted_after_the_copy():
+    user_id = keys_for_shard("user", 1, shard_router.shard_for_user_id, 1)[0]
+    run(insert_rows(0, User, [user_row(user_id)]))
+    run(insert_rows(1, User, [user_row(user_id)]))
+
+    assert run(rebalance_table(User, "id", shard_router.shard_for_user_id)) == 1
+
+    assert run(select_all(0, User)) == []
+    assert [row.id for row in run(select_all(1, User))] == [user_id]
+    assert [change.operation for change in run(select_all(0, UserChange))] == [UserChangeOperation.MOVED]
+    # the copy was already announced on the new shard by the interrupted run
+    assert run(select_all(1, UserChange)) == []
+
+
+def test_rebalance_moves_directory_entries_only_when_they_belong_to_the_same_user():
+    copied, claimed, misplaced = keys_for_shard("email", 2, shard_router.shard_for_email, 3)
+    run(insert_rows(0, UserDirectory, [
+        directory_row(copied, "user-a"), directory_row(claimed, "user-b"), directory_row(misplaced, "user-c"),
+    ]))
+    # an interrupted run already copied the first entry, and the second email was claimed for another user since
+    run(insert_rows(2, UserDirectory, [directory_row(copied, "user-a"), directory_row(claimed, "user-z")]))
+
+    assert run(rebalance_table(UserDirectory, "email", shard_router.shard_for_email)) == 2
+
+    assert [(row.email, row.user_id) for row in run(select_all(0, UserDirectory))] == [(claimed, "user-b")]
+    assert sorted((row.email, row.user_id) for row in run(select_all(2, UserDirectory))) == sorted(
+        [(copied, "user-a"), (claimed, "user-z"), (misplaced, "user-c")]
+    )
+
+
+def test_moved_users_are_found_through_the_session():
+    user_id = keys_for_shard("user", 2, shard_router.shard_for_user_id, 1)[0]
+    run(insert_rows(0, User, [user_row(user_id)]))
+    run(rebalance_table(User, "id", shard_router.shard_for_user_id))
+
+    async def get_user():
+        async with SessionLocal() as db:
+            return await db.get(User, user_id)
+
+    assert run(get_user()).id == user_id
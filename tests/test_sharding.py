@@ -0,0 +1,87 @@
+from types import SimpleNamespace
+
+from sqlalchemy import event, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from conftest import SHARD_COUNT, run
+from src.database import SessionLocal, User, UserChange, UserDirectory, byte_order, shard_router
+from src.database.sharding import ShardRouter, jump_consistent_hash
+
+
+def test_byte_order_uses_the_c_collation_on_postgresql():
+    query = select(User.id).where(byte_order(User.id) > "a").order_by(byte_order(User.id))
+    compiled = str(query.compile(dialect=postgresql.dialect()))
+    assert 'WHERE users.id COLLATE "C" >' in compiled
+    assert 'ORDER BY users.id COLLATE "C"' in compiled
+
+
+def test_byte_order_is_the_plain_column_on_sqlite():
+    query = select(User.id).order_by(byte_order(User.id))
+    assert str(query.compile(dialect=sqlite.dialect())).endswith("ORDER BY users.id")
+
+
+def test_jump_consistent_hash_stays_in_range_and_is_deterministic():
+    for key in range(1000):
+        bucket = jump_consistent_hash(key, 7)
+        assert 0 <= bucket < 7
+        assert jump_consistent_hash(key, 7) == bucket
+    assert jump_consistent_hash(12345, 1) == 0
+
+
+def test_jump_consistent_hash_only_moves_keys_to_a_new_bucket():
+    keys = range(10_000)
+    for buckets in (1, 2, 5, 10):
+        moved = [key for key in keys if jump_consistent_hash(key, buckets) != jump_consistent_hash(key, buckets + 1)]
+        # keys only ever move to the added bucket, and about 1 / (buckets + 1) of them do
+        assert all(jump_consistent_hash(key, buckets + 1) == buckets for key in moved)
+        assert abs(len(moved) / len(keys) - 1 / (buckets + 1)) < 0.02
+
+
+def test_shard_for_email_ignores_case():
+    router = ShardRouter(shard_count=8)
+    assert router.shard_for_email("John.Doe@Example.com") == router.shard_for_email("john.doe@example.com")
+
+
+def choose(statement, parameters: dict | None = None) -> list[int]:
+    router = ShardRouter(shard_count=SHARD_COUNT)
+    return router.execute_chooser(SimpleNamespace(statement=statement, parameters=parameters or {}))
+
+
+def test_execute_chooser_pins_statements_on_the_routing_key():
+    router = ShardRouter(shard_count=SHARD_COUNT)
+    assert choose(select(User).where(User.id == "abc")) == [router.shard_for_user_id("abc")]
+    assert choose(select(User).filter_by(id="abc")) == [router.shard_for_user_id("abc")]
+    assert choose(select(UserChange).where(UserChange.user_id == "abc")) == [router.shard_for_user_id("abc")]
+    assert choose(select(UserDirectory).where(UserDirectory.email == "a@b.com")) == [router.shard_for_email("a@b.com")]
+    assert choose(update(User).where(User.id == "abc").values(name="x")) == [router.shard_for_user_id("abc")]
+    assert choose(select(User).where(User.id.in_(["a", "b", "c"]))) == sorted(
+        {router.shard_for_user_id(user_id) for user_id in ["a", "b", "c"]}
+    )
+
+
+def test_execute_chooser_uses_every_shard_when_the_criteria_do_not_pin_one():
+    assert choose(select(User)) == list(range(SHARD_COUNT))
+    assert choose(select(User).where(User.name == "John Doe")) == list(range(SHARD_COUNT))
+    assert choose(select(User).where(or_(User.id == "a", User.name == "b"))) == list(range(SHARD_COUNT))
+
+
+def test_session_get_queries_only_the_rows_shard(shards):
+    user_id = "abc"
+    statements = {shard_id: 0 for shard_id in range(SHARD_COUNT)}
+    listeners = []
+    for shard_id, shard_engine in enumerate(shards):
+        def count(*args, shard_id=shard_id):
+            statements[shard_id] += 1
+        event.listen(shard_engine.sync_engine, "before_cursor_execute", count)
+        listeners.append((shard_engine.sync_engine, count))
+
+    async def get_user():
+        async with SessionLocal() as db:
+            return await db.get(User, user_id)
+
+    try:
+        assert run(get_user()) is None
+    finally:
+        for sync_engine, count in listeners:
+            event.remove(sync_engine, "before_cursor_execute", count)
+    assert {shard_id for shard_id, count in statements.items() if count} == {shard_router.shard_for_user_id(user_id)}
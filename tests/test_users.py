@@ -0,0 +1,153 @@
+import asyncio
+import datetime
+
+from fastapi import HTTPException, status
+from sqlalchemy import select
+
+from conftest import run
+from src.config.security import security
+from src.database import SessionLocal, User, UserDirectory, scatter_gather, shard_router
+from src.schemas.users import NewUser, UpdateUser, UserFieldsEnum
+from src.services.users import EMAIL_RESERVATION_TIMEOUT, user_service
+
+
+def make_user(user_id: str, email: str | None = None) -> User:
+    return User(
+        id=user_id,
+        name="John Doe",
+        email=email or f"{user_id.lower()}@example.com",
+        password="hashed",
+        dob=datetime.date(1990, 1, 1),
+        address={"name": "123 Main St.", "latitude": 40.75, "longitude": -73.75},
+        description="",
+    )
+
+
+async def add_users(*users: User) -> None:
+    async with SessionLocal() as db:
+        db.add_all(users)
+        await db.commit()
+
+
+def test_fetch_all_users_merges_mixed_case_ids_across_shards():
+    ids = ["alpha", "Bravo", "charlie", "Delta", "echo", "Foxtrot", "golf", "Hotel", "india", "Juliett", "kilo", "Lima"]
+    assert len({shard_router.shard_for_user_id(user_id) for user_id in ids}) > 1
+    run(add_users(*(make_user(user_id) for user_id in ids)))
+
+    users = run(user_service.handle_fetch_all_users(limit=len(ids)))
+    assert [user.id for user in users] == sorted(ids)
+
+
+def test_fetch_all_users_pages_with_a_cursor():
+    ids = ["alpha", "Bravo", "charlie", "Delta", "echo", "Foxtrot", "golf", "Hotel", "india", "Juliett", "kilo", "Lima"]
+    run(add_users(*(make_user(user_id) for user_id in ids)))
+
+    fetched, after = [], None
+    while page := run(user_service.handle_fetch_all_users(limit=5, after=after)):
+        fetched += [user.id for user in page]
+        after = page[-1].id
+    assert fetched == sorted(ids)
+
+    offset_page = run(user_service.handle_fetch_all_users(start=4, limit=3))
+    assert [user.id for user in offset_page] == sorted(ids)[4:7]
+
+
+def new_user(email: str) -> NewUser:
+    return NewUser(email=email, password="qwerty1234", name="John Doe", description="")
+
+
+async def register(email: str) -> int:
+    async with SessionLocal() as db:
+        try:
+            await user_service.handle_create_user(new_user(email), db)
+            return status.HTTP_201_CREATED
+        except HTTPException as e:
+            return e.status_code
+
+
+async def add_directory_entry(email: str, user_id: str, reserved_at: datetime.datetime) -> None:
+    async with SessionLocal() as db:
+        db.add(UserDirectory(email=email, user_id=user_id, reserved_at=reserved_at))
+        await db.commit()
+
+
+async def find_user(email: str) -> User | None:
+    async with SessionLocal() as db:
+        return await security.get_user_by_email(email, db)
+
+
+def test_registering_a_taken_email_is_rejected():
+    assert run(register("john@example.com")) == status.HTTP_201_CREATED
+    assert run(register("john@example.com")) == status.HTTP_400_BAD_REQUEST
+
+
+def test_concurrent_registrations_for_one_email_register_one_user():
+    async def register_concurrently() -> list[int]:
+        return list(await asyncio.gather(*(register("john@example.com") for _ in range(4))))
+
+    assert sorted(run(register_concurrently())) == [status.HTTP_201_CREATED] + [status.HTTP_400_BAD_REQUEST] * 3
+
+    async def count_users() -> int:
+        return sum(len(shard) for shard in await scatter_gather(select(User).where(User.email == "john@example.com")))
+
+    assert run(count_users()) == 1
+
+
+def test_stale_claims_without_a_user_are_taken_over():
+    now = datetime.datetime.now(datetime.timezone.utc)
+    run(add_directory_entry("stale@example.com", "failed-user", now - EMAIL_RESERVATION_TIMEOUT * 2))
+    run(add_directory_entry("fresh@example.com", "in-flight-user", now))
+
+    assert run(register("stale@example.com")) == status.HTTP_201_CREATED
+    assert run(find_user("stale@example.com")) is not None
+    # the claim of a registration that may still be in flight is left alone
+    assert run(register("fresh@example.com")) == status.HTTP_400_BAD_REQUEST
+
+
+def test_claims_are_not_taken_over_from_a_user_holding_the_email():
+    run(add_users(make_user("holder", email="john@example.com")))
+    stale = datetime.datetime.now(datetime.timezone.utc) - EMAIL_RESERVATION_TIMEOUT * 2
+    run(add_directory_entry("john@example.com", "holder", stale))
+
+    assert run(register("john@example.com")) == status.HTTP_400_BAD_REQUEST
+    assert run(find_user("john@example.com")).id == "holder"
+
+
+def test_get_user_by_email_ignores_claims_the_user_does_not_hold():
+    # the user's email change claimed the new email but never completed
+    run(add_users(make_user("holder", email="john@example.com")))
+    run(add_directory_entry("new@example.com", "holder", datetime.datetime.now(datetime.timezone.utc)))
+
+    assert run(find_user("new@example.com")) is None
+
+
+async def change_email(user_id: str, email: str) -> int:
+    async with SessionLocal() as db:
+        try:
+            await user_service.handle_update_user(
+                UpdateUser(user_id=user_id, field=UserFieldsEnum.email, value=email), db
+            )
+            return status.HTTP_200_OK
+        except HTTPException as e:
+            return e.status_code
+
+
+def test_changing_to_an_email_with_a_stale_claim_takes_the_claim_over():
+    assert run(register("john@example.com")) == status.HTTP_201_CREATED
+    john = run(find_user("john@example.com"))
+    stale = datetime.datetime.now(datetime.timezone.utc) - EMAIL_RESERVATION_TIMEOUT * 2
+    run(add_directory_entry("new@example.com", "failed-user", stale))
+
+    assert run(change_email(john.id, "new@example.com")) == status.HTTP_200_OK
+    assert run(find_user("new@example.com")).id == john.id
+    assert run(find_user("john@example.com")) is None
+
+
+def test_changing_to_a_taken_email_is_rejected():
+    assert run(register("john@example.com")) == status.HTTP_201_CREATED
+    assert run(register("jane@example.com")) == status.HTTP_201_CREATED
+    jane = run(find_user("jane@example.com"))
+
+    assert run(change_email(jane.id, "john@example.com")) == status.HTTP_400_BAD_REQUEST
+    assert run(find_user("jane@example.com")).id == jane.id
+    assert run(find_user("john@example.com")).id != jane.id